@@ -49,7 +49,11 @@ extras_require["dev"] = sorted(
     + [
         "dask[array]",
         "fiona",
+        "geopandas",
         "landsatxplore>=0.13.0",
+        "numba",
+        "numexpr",
+        "orjson",
         "pandas",
         "pyproj>=3.0.0",
         "requests_mock",
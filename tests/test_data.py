@@ -1,15 +1,23 @@
+import json
+import os
 import unittest
+import zipfile
 from datetime import datetime
+from io import BytesIO
 from pathlib import Path
-from tempfile import gettempdir
+from tempfile import gettempdir, TemporaryDirectory
+from unittest import mock
 
+import numpy as np
 import pystac
 import requests_mock
+import sentinelsat
+from PIL import Image
 from pkg_resources import resource_filename
-from shapely.geometry import Polygon
+from shapely.geometry import Polygon, shape
 
 from ukis_pysat._landsat import Product, meta_from_pid, compute_md5
-from ukis_pysat.data import Source
+from ukis_pysat.data import Source, _get_bbox_from_geometry_string, _pack_and_remove
 from ukis_pysat.members import Datahub, Platform, Bands
 
 # os.environ["EARTHEXPLORER_USER"] = "Tim"
@@ -59,6 +67,33 @@ class DataTest(unittest.TestCase):
         self.assertEqual(tuple(geom.exterior.coords), ((0.0, 0.0), (0.0, 1.0), (1.0, 1.0), (2.0, -1.0), (0.0, 0.0)))
         self.assertEqual(len(geom.interiors), 1)
 
+    def test_get_bbox_from_geometry_string(self):
+        geom = {
+            "type": "MultiPolygon",
+            "coordinates": [
+                [[[1.0, 2.0], [3.0, 5.0], [0.0, 4.0], [1.0, 2.0]]],
+                [[[10.0, -2.0], [11.0, 0.0], [9.0, 1.0], [10.0, -2.0]]],
+            ],
+        }
+        self.assertEqual(_get_bbox_from_geometry_string(geom), list(shape(geom).bounds))
+
+        for geom_type, coordinates in (
+            ("Polygon", []),
+            ("MultiPolygon", []),
+            ("Polygon", [[]]),
+            ("MultiPolygon", [[]]),
+        ):
+            geom = {"type": geom_type, "coordinates": coordinates}
+            self.assertEqual(_get_bbox_from_geometry_string(geom), list(shape(geom).bounds))
+
+    def test_aoi_cached(self):
+        self.assertIs(Source._prep_aoi(aoi_bbox), Source._prep_aoi(aoi_bbox))
+        self.assertIs(Source._prep_aoi(aoi_3857), Source._prep_aoi(str(aoi_3857)))
+        self.assertEqual(
+            tuple(round(c, 6) for c in Source._prep_aoi(aoi_3857).bounds),
+            tuple(round(c, 6) for c in Source._prep_aoi(aoi_4326).bounds),
+        )
+
     # @unittest.skip("Skip until we find a better test or this also runs with Github Actions")
     def test_query_metadata_stac_local(self):
         with Source(datahub=Datahub.STAC_local, catalog=catalog_path) as src:
@@ -76,6 +111,41 @@ class DataTest(unittest.TestCase):
             cat.normalize_hrefs(Path(gettempdir()).as_posix())
             cat.validate_all()
 
+    def test_filter_metadata(self):
+        with Source(datahub=Datahub.STAC_local, catalog=catalog_path) as src:
+            items = list(src.api.get_all_items())
+            filtered = src.filter_metadata(items, {"producttype": "S2MSI1C", "platform": "Sentinel-2"})
+            self.assertEqual(
+                [item.id for item in filtered], ["S2A_MSIL1C_20200221T102041_N0209_R065_T32UPC_20200221T110731"]
+            )
+            self.assertEqual(src.filter_metadata(items, {"producttype": "S2MSI1C", "platform": "Sentinel-1"}), [])
+
+    def test_query_metadata_df(self):
+        with Source(datahub=Datahub.STAC_local, catalog=catalog_path) as src:
+            gdf = src.query_metadata_df(
+                platform=Platform.Sentinel2,
+                date=("20200220", "20200222"),
+                aoi=aoi_3857,
+                cloud_cover=(90, 100),
+            )
+            self.assertEqual(list(gdf["id"]), ["S2A_MSIL1C_20200221T102041_N0209_R065_T32UPC_20200221T110731"])
+            self.assertEqual(gdf.iloc[0]["srcuuid"], "ae674e64-013d-4898-a6d7-096d7b02bdde")
+            self.assertEqual(gdf.crs, "EPSG:4326")
+
+            filtered = src.filter_metadata_df(gdf, {"producttype": "S2MSI1C", "platform": "Sentinel-2"})
+            self.assertEqual(list(filtered["id"]), list(gdf["id"]))
+            self.assertTrue(src.filter_metadata_df(gdf, {"producttype": "S2MSI1C", "platform": "Sentinel-1"}).empty)
+            self.assertTrue(src.filter_metadata_df(gdf, {"missing": 1}).empty)
+
+    def test_download_metadata(self):
+        with Source(datahub=Datahub.STAC_local, catalog=catalog_path) as src:
+            items = list(src.api.get_all_items())
+            with TemporaryDirectory() as td:
+                src.download_metadata(items, td)
+                for item in items:
+                    with open(Path(td).joinpath(item.id + ".json")) as f:
+                        self.assertEqual(json.load(f)["properties"], item.properties)
+
     @requests_mock.Mocker(real_http=True)
     def test_query_metadata_scihub(self, m):
         m.get(
@@ -216,6 +286,79 @@ class DataTest(unittest.TestCase):
             product._url("B1.tif"),
         )
 
+    def test_download_images(self):
+        with Source(datahub=Datahub.STAC_local, catalog=catalog_path) as src:
+            with self.assertRaises(NotImplementedError):
+                src.download_images(["uuid"], gettempdir())
+
+        def download_image(product_uuid, target_dir):
+            if product_uuid == "failing":
+                raise ValueError(product_uuid)
+
+        with mock.patch.dict(os.environ, {"EARTHEXPLORER_USER": "x", "EARTHEXPLORER_PW": "x"}), mock.patch(
+            "landsatxplore.api.API"
+        ), Source(datahub=Datahub.EarthExplorer) as src:
+            with mock.patch.object(src, "download_image", side_effect=download_image) as download:
+                errors = src.download_images(["a", "failing", "b", "a"], gettempdir())
+                self.assertEqual(sorted(call.args[0] for call in download.call_args_list), ["a", "b", "failing"])
+                self.assertEqual(list(errors), ["failing"])
+                self.assertIsInstance(errors["failing"], ValueError)
+
+        with mock.patch.dict(os.environ, {"SCIHUB_USER": "x", "SCIHUB_PW": "x"}), Source(datahub=Datahub.Scihub) as src:
+            src.api = mock.Mock()
+            src.api.download_all.return_value = ({"a": {}}, {"offline": {}}, {"failing": {"exception": ValueError()}})
+            errors = src.download_images(["a", "offline", "failing", "a"], gettempdir(), max_workers=2)
+            src.api.download_all.assert_called_once_with(
+                ["a", "offline", "failing"], gettempdir(), checksum=True, n_concurrent_dl=2
+            )
+            self.assertEqual(sorted(errors), ["failing", "offline"])
+            self.assertIsInstance(errors["failing"], ValueError)
+            self.assertIsInstance(errors["offline"], sentinelsat.exceptions.LTATriggered)
+
+            src.api.download_all.side_effect = ValueError()
+            errors = src.download_images(["a", "b"], gettempdir())
+            self.assertEqual(sorted(errors), ["a", "b"])
+
+    @requests_mock.Mocker()
+    def test_download_quicklook(self, m):
+        # bright 64x64 image with a black no-data border of 8 pixels, aligned with the JPEG blocks
+        quicklook = np.zeros((80, 80, 3), dtype=np.uint8)
+        quicklook[8:72, 8:72] = 200
+        buffer = BytesIO()
+        Image.fromarray(quicklook).save(buffer, format="JPEG", quality=95)
+        m.get(requests_mock.ANY, content=buffer.getvalue())
+
+        with mock.patch.dict(os.environ, {"SCIHUB_USER": "x", "SCIHUB_PW": "x"}), Source(datahub=Datahub.Scihub) as src:
+            src.api = mock.Mock()
+            src.api.get_product_odata.return_value = {
+                "footprint": "POLYGON((10 50, 12 50, 12 52, 10 52, 10 50))",
+                "title": "S2A_quicklook",
+            }
+
+            for reduce, size in ((1, 64), (4, 16)):
+                with TemporaryDirectory() as td:
+                    src.download_quicklook("uuid", td, reduce=reduce)
+                    with Image.open(Path(td).joinpath("S2A_quicklook.jpg")) as img:
+                        self.assertEqual(img.size, (size, size))
+                    world_file = Path(td).joinpath("S2A_quicklook.jpgw").read_text().split()
+                    self.assertEqual([float(v) for v in world_file], [2 / size, 0.0, 0.0, -2 / size, 10.0, 52.0])
+
+            with self.assertRaises(ValueError):
+                src.download_quicklook("uuid", gettempdir(), reduce=3)
+
+    def test_pack_and_remove(self):
+        with TemporaryDirectory() as td:
+            src_dir = Path(td).joinpath("product")
+            src_dir.joinpath("sub").mkdir(parents=True)
+            src_dir.joinpath("b.txt").write_text("b")
+            src_dir.joinpath("sub", "a.txt").write_text("a")
+            _pack_and_remove(src_dir, Path(td).joinpath("product.zip"))
+
+            self.assertFalse(src_dir.exists())
+            with zipfile.ZipFile(Path(td).joinpath("product.zip")) as zf:
+                self.assertEqual(zf.namelist(), ["b.txt", "sub/a.txt"])
+                self.assertEqual(zf.read("sub/a.txt"), b"a")
+
     @requests_mock.Mocker(real_http=True)
     def test_get_srcid_from_product_uuid_ee(self, m):
         m.post(
@@ -1,21 +1,39 @@
 #!/usr/bin/env python3
 import os
 import unittest
+import warnings
 from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
 
 import dask.array
 import numpy as np
+import rasterio
 from rasterio import windows
 from rasterio.coords import BoundingBox
 from rasterio.transform import from_bounds
+from rio_toa import toa_utils
 from shapely.geometry import box
 
+from ukis_pysat import raster
 from ukis_pysat.members import Platform
-from ukis_pysat.raster import Image
+from ukis_pysat.raster import Image, _gdal_env, configure_gdal
 
 TEST_FILE = Path(__file__).parents[0] / "testfiles" / "dummy.tif"
 
 
+def _allclose_windowed(img_a, img_b):
+    """Compares the arrays of two images block by block and stops at the first block that differs. The temporary
+    arrays of np.allclose are only as large as a block, the arrays themselves are not read again."""
+    if img_a.arr.shape != img_b.arr.shape:
+        return False
+    for _, window in img_a.dataset.block_windows(1):
+        block = (slice(None),) + window.toslices()
+        if not np.allclose(img_a.arr[block], img_b.arr[block], equal_nan=True):
+            return False
+    return True
+
+
 class RasterTest(unittest.TestCase):
     def setUp(self):
         self.img = Image(TEST_FILE)
@@ -63,6 +81,30 @@ class RasterTest(unittest.TestCase):
         with self.assertRaises(TypeError):
             Image(data=self.img.arr, crs=self.img.dataset.transform)
 
+    def test_configure_gdal(self):
+        default_cachemax = configure_gdal()["GDAL_CACHEMAX"]
+        try:
+            self.assertEqual(configure_gdal(GDAL_CACHEMAX=64 * 1024**2)["GDAL_CACHEMAX"], 64 * 1024**2)
+            with Image(TEST_FILE) as img:
+                self.assertTrue(np.array_equal(self.img.arr, img.arr))
+        finally:
+            configure_gdal(GDAL_CACHEMAX=default_cachemax)
+
+        with rasterio.Env(GDAL_CACHEMAX=64 * 1024**2):
+            with _gdal_env():
+                self.assertEqual(rasterio.env.getenv()["GDAL_CACHEMAX"], 64 * 1024**2)
+                self.assertEqual(rasterio.env.getenv()["GDAL_NUM_THREADS"], "ALL_CPUS")
+
+    def test_world_file(self):
+        with TemporaryDirectory() as tmpdir:
+            jpg = Path(tmpdir) / "quicklook.jpg"
+            with rasterio.open(jpg, "w", driver="JPEG", width=10, height=10, count=3, dtype="uint8") as dst:
+                dst.write(np.ones((3, 10, 10), dtype="uint8"))
+            jpg.with_suffix(".jpgw").write_text("0.1\n0\n0\n-0.1\n11.0\n51.0\n")
+
+            with Image(jpg) as img:
+                self.assertTrue(np.allclose(img.dataset.transform[:6], (0.1, 0, 10.95, 0, -0.1, 51.05)))
+
     def test_dimorder_error(self):
         with self.assertRaises(TypeError):
             Image(TEST_FILE, dimorder="middle")
@@ -277,13 +319,23 @@ class RasterTest(unittest.TestCase):
             )
 
             # np.array_equal did not work on Github Runner environment
-            self.assertTrue(np.allclose(img_dn.arr, img_toa.arr, equal_nan=True))
+            self.assertTrue(_allclose_windowed(img_dn, img_toa))
             img_dn.close()
             img_toa.close()
 
         with self.assertRaises(AttributeError, msg=f"'mtl_file' has to be set if platform is {Platform.Landsat8}."):
             self.img.dn2toa(platform=Platform.Landsat8)
 
+        mtl_file = target_dir.joinpath("LC08_L1TP_193024_20200509_20200509_01_RT_MTL.txt")
+        mtl = toa_utils._load_mtl(str(mtl_file))
+        mtl["L1_METADATA_FILE"]["IMAGE_ATTRIBUTES"]["SUN_ELEVATION"] = -1.0
+        with mock.patch("ukis_pysat.raster.toa_utils._load_mtl", return_value=mtl), self.assertRaises(ValueError):
+            with Image(tests[0]["dn_file"]) as img:
+                img.dn2toa(platform=Platform.Landsat8, mtl_file=mtl_file, wavelengths=tests[0]["wavelengths"])
+
+        with self.assertRaises(TypeError, msg="dtype_out must be either 'float32' or 'uint16'."):
+            self.img.dn2toa(platform=Platform.Landsat8, dtype_out="float64")
+
         with self.assertRaises(
             AttributeError,
             msg=f"Cannot convert dn2toa. Platform {Platform.Sentinel1} not "
@@ -316,8 +368,116 @@ class RasterTest(unittest.TestCase):
                 self.assertTrue(np.array_equal(array, np.zeros(shape=(7, 7), dtype=array.dtype)))
                 self.assertEqual(bounds, (11.903960582768779, 51.45624717410995, 11.904589403469808, 51.45687599481152))
 
+    def _assert_dn2toa_without_numexpr(self, dn2toa_numba):
+        """Checks dn2toa against the reference TOA scenes with numexpr patched out and the given numba kernel."""
+        target_dir = Path(__file__).parents[0] / "testfiles" / "satellite_data"
+        tests = [
+            {
+                "platform": Platform.Landsat8,
+                "dn_file": target_dir.joinpath("LC08_L1TP_193024_20200509_20200509_01_RT.tif"),
+                "toa_file": target_dir.joinpath("LC08_L1TP_193024_20200509_20200509_01_RT_toa.tif"),
+                "mtl_file": target_dir.joinpath("LC08_L1TP_193024_20200509_20200509_01_RT_MTL.txt"),
+                "wavelengths": ["Aerosol", "Blue", "Green", "Red", "NIR", "SWIR1", "SWIR2", "Cirrus", "TIRS1", "TIRS2"],
+            },
+            {
+                "platform": Platform.Landsat7,
+                "dn_file": target_dir.joinpath("LE07_L1TP_193024_20100420_20161215_01_T1.tif"),
+                "toa_file": target_dir.joinpath("LE07_L1TP_193024_20100420_20161215_01_T1_toa.tif"),
+                "mtl_file": target_dir.joinpath("LE07_L1TP_193024_20100420_20161215_01_T1_MTL.txt"),
+                "wavelengths": ["Blue", "Green", "Red", "NIR", "SWIR1", "TIRS1", "TIRS2", "SWIR2"],
+            },
+        ]
+        with mock.patch("ukis_pysat.raster.numexpr", None), mock.patch(
+            "ukis_pysat.raster._get_dn2toa_numba", return_value=dn2toa_numba
+        ) as get_dn2toa_numba:
+            for test in tests:
+                with Image(test["dn_file"]) as img_dn, Image(test["toa_file"]) as img_toa:
+                    img_dn.dn2toa(platform=test["platform"], mtl_file=test["mtl_file"], wavelengths=test["wavelengths"])
+                    self.assertTrue(_allclose_windowed(img_dn, img_toa))
+            get_dn2toa_numba.assert_called()
+
+    def test_dn2toa_numba(self):
+        dn2toa_numba = raster._get_dn2toa_numba()
+        self.assertIsNotNone(dn2toa_numba)
+        self._assert_dn2toa_without_numexpr(dn2toa_numba)
+
+    def test_dn2toa_numpy(self):
+        # without numexpr and numba dn2toa falls back to plain numpy
+        self._assert_dn2toa_without_numexpr(None)
+
+    def test_dn2toa_uint16(self):
+        target_dir = Path(__file__).parents[0] / "testfiles" / "satellite_data"
+        tests = [
+            {
+                "platform": Platform.Landsat8,
+                "dn_file": target_dir.joinpath("LC08_L1TP_193024_20200509_20200509_01_RT.tif"),
+                "mtl_file": target_dir.joinpath("LC08_L1TP_193024_20200509_20200509_01_RT_MTL.txt"),
+                "wavelengths": ["Aerosol", "Blue", "Green", "Red", "NIR", "SWIR1", "SWIR2", "Cirrus", "TIRS1", "TIRS2"],
+                "scales": (0.0001,) * 8 + (0.01,) * 2,
+                "dtype_out": "uint16",
+            },
+            {
+                "platform": Platform.Sentinel2,
+                "dn_file": target_dir.joinpath("S2B_MSIL1C_20200406T101559_N0209_R065_T32UPC_20200406T130159.tif"),
+                "mtl_file": None,
+                "wavelengths": None,
+                "scales": None,
+                "dtype_out": np.uint16,
+            },
+        ]
+
+        for test in tests:
+            img_float = Image(test["dn_file"])
+            img_uint16 = Image(test["dn_file"])
+            img_float.dn2toa(platform=test["platform"], mtl_file=test["mtl_file"], wavelengths=test["wavelengths"])
+            img_uint16.dn2toa(
+                platform=test["platform"],
+                mtl_file=test["mtl_file"],
+                wavelengths=test["wavelengths"],
+                dtype_out=test["dtype_out"],
+            )
+            scales = test["scales"] or (0.0001,) * img_uint16.dataset.count
+
+            self.assertEqual(img_uint16.arr.dtype, np.uint16)
+            self.assertTupleEqual(img_uint16.dataset.scales, scales)
+            self.assertEqual(img_uint16.dataset.nodata, 0)
+
+            expected = np.nan_to_num(img_float.arr)
+            restored = img_uint16.arr * np.array(scales, dtype=np.float32)[:, np.newaxis, np.newaxis]
+            self.assertTrue(np.allclose(restored, expected, rtol=0, atol=0.006))
+
+            with img_uint16.write_to_memoryfile(dtype="uint16") as memfile, memfile.open() as ds:
+                self.assertTupleEqual(ds.scales, scales)
+
+            # scales are kept by later processing steps
+            img_uint16.pad(2)
+            self.assertTupleEqual(img_uint16.dataset.scales, scales)
+            img_uint16.mask(box(*img_float.dataset.bounds))
+            self.assertTupleEqual(img_uint16.dataset.scales, scales)
+            with img_uint16.write_to_memoryfile(dtype="uint16") as memfile, memfile.open() as ds:
+                self.assertTupleEqual(ds.scales, scales)
+
+            img_float.close()
+            img_uint16.close()
+
     def test_get_dask_array(self):
-        self.assertIsInstance(self.img.to_dask_array(chunk_size=(1, 10, 10)), dask.array.core.Array)
+        with self.assertWarns(UserWarning):
+            self.assertIsInstance(self.img.to_dask_array(chunk_size=(1, 10, 10)), dask.array.core.Array)
+
+        block_y, block_x = self.img.dataset.block_shapes[0]
+        da_arr = self.img.to_dask_array()
+        self.assertEqual(da_arr.chunksize[0], self.img.arr.shape[0])
+        self.assertTrue(all(chunk % block_y == 0 for chunk in da_arr.chunks[1][:-1]))
+        self.assertTrue(all(chunk % block_x == 0 for chunk in da_arr.chunks[2][:-1]))
+        self.assertEqual(self.img.to_dask_array(chunk_mb=1).chunksize, self.img.arr.shape)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            self.assertEqual(self.img.to_dask_array(chunk_size=(1, None, None)).chunksize, self.img.arr.shape)
+            self.assertEqual(self.img.to_dask_array(chunk_size=(1, -1, -1)).chunksize, self.img.arr.shape)
+
+        with self.assertRaises(ValueError):
+            self.img.to_dask_array(chunk_size=(10,))
 
     def test_write_to_file(self):
         self.img.write_to_file(r"result.tif", np.uint16)
@@ -348,6 +508,17 @@ class RasterTest(unittest.TestCase):
 
         os.remove(r"result.tif")
 
+    def test_write_to_memoryfile(self):
+        with self.img.write_to_memoryfile(np.uint16) as memfile:
+            with memfile.open() as dataset, Image(dataset) as img2:
+                self.assertTrue(np.array_equal(img2.arr, self.img.arr))
+                self.assertEqual(img2.arr.dtype, "uint16")
+
+        with self.img.write_to_memoryfile("min", compress="lzw") as memfile:
+            with memfile.open() as dataset:
+                self.assertEqual(dataset.dtypes[0], "uint8")
+                self.assertEqual(dataset.profile["compress"], "lzw")
+
 
 if __name__ == "__main__":
     unittest.main()
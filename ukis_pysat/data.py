@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 import datetime
+import json
 import shutil
 import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from io import BytesIO
 from pathlib import Path
 
@@ -29,9 +33,17 @@ except ImportError as e:
     )
     raise ImportError(str(e) + "\n\n" + msg)
 
+try:
+    import orjson
+except ImportError:
+    orjson = None  # optional, faster serialization in download_metadata
+
 from ukis_pysat.file import env_get
 from ukis_pysat.members import Datahub
 
+# pyproj Transformers to epsg:4326 by source crs
+_TRANSFORMER_CACHE = {}
+
 
 class Source:
     """
@@ -72,6 +84,9 @@ class Source:
             self.user = env_get("EARTHEXPLORER_USER")
             self.pw = env_get("EARTHEXPLORER_PW")
             self.api = landsatxplore.api.API(self.user, self.pw)
+            # persistent session for other HTTP requests, e.g. quicklooks
+            self.session = requests.Session()
+            self.session.auth = (self.user, self.pw)
 
         elif self.src == Datahub.Scihub:
             # connect to Scihub
@@ -83,6 +98,9 @@ class Source:
                 "https://apihub.copernicus.eu/apihub",
                 show_progressbars=False,
             )
+            # persistent session for other HTTP requests, e.g. quicklooks
+            self.session = requests.Session()
+            self.session.auth = (self.user, self.pw)
 
         else:
             raise NotImplementedError(f"{datahub} is not supported [STAC_local, EarthExplorer, Scihub]")
@@ -200,6 +218,78 @@ class Source:
             for meta in self.api.to_geojson(self.api.query(identifier=srcid))["features"]:
                 yield self.construct_metadata(meta=meta, platform=platform)
 
+    @staticmethod
+    def filter_metadata(meta, filter_dict):
+        """Filters metadata items by their properties.
+
+        :param meta: Metadata items, e.g. as generated by query_metadata (Iterable of PySTAC items).
+        :param filter_dict: Properties that have to match, e.g. {"producttype": "S2MSI1C"} (Dictionary).
+        :returns: Metadata items that match all filters (List of PySTAC items).
+        """
+        return [item for item in meta if all(item.properties.get(k) == v for k, v in filter_dict.items())]
+
+    def query_metadata_df(self, platform, date, aoi, cloud_cover=None, kwargs=None):
+        """Queries metadata from data source and returns it as a table with one column per property, which allows
+        vectorized filtering of large query results, e.g. with filter_metadata_df.
+
+        :param platform: Image platform (<enum 'Platform'>).
+        :param date: Date from - to in format yyyyMMdd (String or Datetime tuple).
+        :param aoi: Area of interest as GeoJson file or bounding box tuple with lat lon coordinates (String, Tuple).
+        :param cloud_cover: Percent cloud cover scene from - to (Integer tuple) (default: None).
+        :param kwargs: Dictionary of the additional requirements for the hub used (default: None).
+        :returns: Metadata of products that match query criteria with id, geometry and property columns
+            (geopandas.GeoDataFrame).
+        """
+        try:
+            import geopandas
+        except ImportError:
+            raise ImportError("query_metadata_df requires optional dependency geopandas.")
+
+        items = list(self.query_metadata(platform, date, aoi, cloud_cover, kwargs))
+        gdf = geopandas.GeoDataFrame(
+            [item.properties for item in items],
+            geometry=[shape(item.geometry) for item in items],
+            crs="EPSG:4326",
+        )
+        gdf.insert(0, "id", [item.id for item in items])
+        return gdf
+
+    @staticmethod
+    def filter_metadata_df(gdf, filter_dict):
+        """Filters metadata from query_metadata_df by its properties.
+
+        :param gdf: Metadata as returned by query_metadata_df (geopandas.GeoDataFrame).
+        :param filter_dict: Properties that have to match, e.g. {"producttype": "S2MSI1C"} (Dictionary).
+        :returns: Metadata that matches all filters (geopandas.GeoDataFrame).
+        """
+        mask = np.ones(len(gdf), dtype=bool)
+        for k, v in filter_dict.items():
+            if k not in gdf.columns:
+                mask[:] = False
+                break
+            mask &= (gdf[k] == v).to_numpy()
+        return gdf.loc[mask].copy()
+
+    @staticmethod
+    def download_metadata(meta, target_dir, max_workers=8):
+        """Writes metadata items as JSON files named after their id to a target directory.
+        Files are written concurrently, because writing many small files is bound by file system latency.
+
+        :param meta: Metadata items, e.g. as generated by query_metadata (Iterable of PySTAC items).
+        :param target_dir: Target directory that holds the metadata files (String, Path)
+        :param max_workers: Maximum number of threads that write files (Integer) (default: 8).
+        """
+        if isinstance(target_dir, str):
+            target_dir = Path(target_dir)
+
+        def _write_item(item):
+            with open(target_dir.joinpath(item.id + ".json"), "wb") as out_file:
+                out_file.write(_dumps_json(item.to_dict()))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # consume results to raise exceptions of the workers
+            list(executor.map(_write_item, meta))
+
     def construct_metadata(self, meta, platform):
         """Constructs a STAC item that is harmonized across the different satellite image sources.
 
@@ -327,23 +417,74 @@ class Source:
                 product.download(out_dir=target_dir, progressbar=False)
 
                 # compress download directory and remove original files
-                shutil.make_archive(
-                    target_dir.joinpath(product_srcid),
-                    "zip",
-                    root_dir=target_dir.joinpath(product_srcid),
-                )
-                shutil.rmtree(target_dir.joinpath(product_srcid))
+                _pack_and_remove(target_dir.joinpath(product_srcid), target_dir.joinpath(product_srcid + ".zip"))
 
         else:
             self.api.download(product_uuid, target_dir, checksum=True)
 
-    def download_quicklook(self, product_uuid, target_dir):
+    def download_images(self, product_uuids, target_dir, max_workers=None):
+        """Downloads satellite image data of several products concurrently to a target directory.
+        Incomplete downloads are continued and complete files are skipped.
+
+        :param product_uuids: UUIDs of the satellite image products (List of Strings).
+        :param target_dir: Target directory that holds the downloaded images (String, Path)
+        :param max_workers: Maximum number of concurrent downloads (Integer) (default: None, which means the limit of
+            sentinelsat for Scihub and 8 otherwise).
+        :returns: Exceptions of failed downloads by product UUID (Dictionary). Scihub products that are offline and
+            only triggered for retrieval from the Long Term Archive are returned with sentinelsat's LTATriggered.
+        """
+        if self.src == Datahub.STAC_local:
+            raise NotImplementedError(
+                f"download_images not supported for {self.src}. It is much easier to get the assets yourself now."
+            )
+
+        # duplicates would be downloaded to the same target concurrently
+        product_uuids = list(dict.fromkeys(product_uuids))
+
+        if self.src == Datahub.Scihub:
+            # sentinelsat downloads concurrently on its own session and handles offline products
+            try:
+                _, triggered, failed = self.api.download_all(
+                    product_uuids, target_dir, checksum=True, n_concurrent_dl=max_workers
+                )
+            except Exception as e:
+                # sentinelsat raises the last exception if all downloads failed
+                return {product_uuid: e for product_uuid in product_uuids}
+
+            errors = {product_uuid: sentinelsat.exceptions.LTATriggered(product_uuid) for product_uuid in triggered}
+            for product_uuid, product_info in failed.items():
+                errors[product_uuid] = product_info.get(
+                    "exception", sentinelsat.SentinelAPIError(f"Download of {product_uuid} failed.")
+                )
+            return errors
+
+        if max_workers is None:
+            max_workers = 8
+
+        errors = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self.download_image, product_uuid, target_dir): product_uuid
+                for product_uuid in product_uuids
+            }
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    errors[futures[future]] = future.exception()
+
+        return errors
+
+    def download_quicklook(self, product_uuid, target_dir, reduce=1):
         """Downloads a quicklook of the satellite image to a target directory for a specific product_id.
         It performs a very rough geocoding of the quicklooks by shifting the image to the location of the footprint.
 
         :param product_uuid: UUID of the satellite image product (String).
         :param target_dir: Target directory that holds the downloaded images (String, Path)
+        :param reduce: Reduces the resolution of the quicklook by this factor while decoding the JPEG, which is much
+            faster than decoding at full resolution, 1, 2, 4 or 8 (Integer) (default: 1).
         """
+        if reduce not in (1, 2, 4, 8):
+            raise ValueError(f"reduce must be one of [1, 2, 4, 8] and not {reduce}.")
+
         if isinstance(target_dir, str):
             target_dir = Path(target_dir)
 
@@ -362,25 +503,29 @@ class Source:
             product_srcid = meta_src["title"]
 
         # download quicklook and crop no-data borders
-        response = requests.get(url, auth=(self.user, self.pw))
-        quicklook = np.asarray(Image.open(BytesIO(response.content)))
+        response = self.session.get(url)
+        response.raise_for_status()
+        with Image.open(BytesIO(response.content)) as pil_image:
+            if reduce > 1:
+                # JPEG scale-on-decode, no effect on other formats
+                pil_image.draft(pil_image.mode, (pil_image.width // reduce, pil_image.height // reduce))
+            quicklook = np.asarray(pil_image)
         # use threshold of 50 to overcome noise in JPEG compression
-        xs, ys, zs = np.where(quicklook >= 50)
-        quicklook = quicklook[min(xs) : max(xs) + 1, min(ys) : max(ys) + 1, min(zs) : max(zs) + 1]
+        valid = quicklook >= 50
+        if valid.ndim == 3:
+            valid = valid.any(axis=2)
+        rows = np.flatnonzero(valid.any(axis=1))
+        cols = np.flatnonzero(valid.any(axis=0))
+        quicklook = quicklook[rows[0] : rows[-1] + 1, cols[0] : cols[-1] + 1]
         Image.fromarray(quicklook).save(target_dir.joinpath(product_srcid + ".jpg"))
 
         # geocode quicklook
         quicklook_size = (quicklook.shape[1], quicklook.shape[0])
-        dist_x = geometry.Point(bounds[0], bounds[1]).distance(geometry.Point(bounds[2], bounds[1])) / quicklook_size[0]
-        dist_y = geometry.Point(bounds[0], bounds[1]).distance(geometry.Point(bounds[0], bounds[3])) / quicklook_size[1]
+        dist_x = abs(bounds[2] - bounds[0]) / quicklook_size[0]
+        dist_y = abs(bounds[3] - bounds[1]) / quicklook_size[1]
         ul_x, ul_y = bounds[0], bounds[3]
         with open(target_dir.joinpath(product_srcid + ".jpgw"), "w") as out_file:
-            out_file.write(str(dist_x) + "\n")
-            out_file.write(str(0.0) + "\n")
-            out_file.write(str(0.0) + "\n")
-            out_file.write(str(-dist_y) + "\n")
-            out_file.write(str(ul_x) + "\n")
-            out_file.write(str(ul_y) + "\n")
+            out_file.write(f"{dist_x}\n0.0\n0.0\n{-dist_y}\n{ul_x}\n{ul_y}\n")
 
     @staticmethod
     def _prep_aoi(aoi):
@@ -395,39 +540,28 @@ class Source:
         if isinstance(aoi, (str, Path)):
             # check if handed object is a file
             if Path(aoi).is_file():
-                try:
-                    import fiona
-                    import pyproj
-                except ImportError:
-                    raise ImportError("if your AOI is a file optional dependencies [fiona, pyproj] are required.")
-                with fiona.open(aoi, "r") as aoi:
-                    # make sure crs is in epsg:4326
-                    project = pyproj.Transformer.from_proj(
-                        proj_from=pyproj.Proj(aoi.crs["init"]),
-                        proj_to=pyproj.Proj("epsg:4326"),
-                        always_xy=True,
-                    )
-                    aoi = ops.transform(project.transform, geometry.shape(aoi[0]["geometry"]))
-            else:
-                aoi = wkt.loads(aoi)
+                aoi_file = Path(aoi).resolve()
+                # modification time is part of the cache key, so that changed files are read again
+                return _prep_aoi_cached(str(aoi_file), aoi_file.stat().st_mtime)
+            return _prep_aoi_cached(str(aoi))
 
         elif isinstance(aoi, dict):
-            aoi = shape(aoi)
+            return shape(aoi)
 
         elif isinstance(aoi, tuple):
-            aoi = geometry.box(aoi[0], aoi[1], aoi[2], aoi[3])
+            return _prep_aoi_cached(aoi)
 
         else:
             raise TypeError(f"aoi must be of type string, Path, tuple or __geo_interface__")
 
-        return aoi
-
     def close(self):
         """Closes connection to or logs out of Datahub."""
         if self.src == Datahub.EarthExplorer:
             self.api.logout()
+            self.session.close()
         elif self.src == Datahub.Scihub:
             self.api.session.close()
+            self.session.close()
         else:
             pass
 
@@ -435,5 +569,79 @@ class Source:
         self.close()
 
 
+@lru_cache(maxsize=128)
+def _prep_aoi_cached(aoi, mtime=None):
+    """Converts hashable aois for Source._prep_aoi, results are cached because the same aoi is usually queried
+    many times.
+
+    :param aoi: Path to Geojson file, WKT string or bounding box tuple in lat lon coordinates (String, Tuple)
+    :param mtime: Modification time of the Geojson file, only used as part of the cache key (default: None, aoi is
+        not a file)
+    :return: Shapely Polygon
+    """
+    if isinstance(aoi, tuple):
+        return geometry.box(aoi[0], aoi[1], aoi[2], aoi[3])
+
+    if mtime is None:
+        return wkt.loads(aoi)
+
+    try:
+        import fiona
+        import pyproj
+    except ImportError:
+        raise ImportError("if your AOI is a file optional dependencies [fiona, pyproj] are required.")
+    with fiona.open(aoi, "r") as aoi:
+        # make sure crs is in epsg:4326, transformers are expensive to build and therefore reused
+        crs = aoi.crs["init"]
+        if crs not in _TRANSFORMER_CACHE:
+            _TRANSFORMER_CACHE[crs] = pyproj.Transformer.from_proj(
+                proj_from=pyproj.Proj(crs),
+                proj_to=pyproj.Proj("epsg:4326"),
+                always_xy=True,
+            )
+        return ops.transform(_TRANSFORMER_CACHE[crs].transform, geometry.shape(aoi[0]["geometry"]))
+
+
+def _pack_and_remove(src_dir, archive):
+    """Packs all files of a directory into a zip archive and removes each file as soon as it is archived, so that
+    the data is not kept twice on disk. The archive is only moved to its final name once it is complete.
+
+    :param src_dir: Directory to pack (Path).
+    :param archive: Path of the zip archive (Path).
+    """
+    partial_archive = archive.with_name(archive.name + ".part")
+    with zipfile.ZipFile(partial_archive, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for path in sorted(p for p in src_dir.rglob("*") if p.is_file()):
+            zf.write(path, arcname=path.relative_to(src_dir).as_posix())
+            path.unlink()
+    partial_archive.replace(archive)
+    shutil.rmtree(src_dir)
+
+
 def _get_bbox_from_geometry_string(geom):
-    return list(geometry.shape(geom).bounds)
+    """Bounding box of a GeoJSON-like geometry. For (multi) polygons and lines it is read directly from the
+    coordinates, which avoids building a Shapely geometry for every metadata record.
+
+    :param geom: GeoJSON-like mapping
+    :return: list with [minx, miny, maxx, maxy]
+    """
+    # levels of nesting above the positions
+    depth = {"LineString": 0, "MultiPoint": 0, "MultiLineString": 1, "Polygon": 1, "MultiPolygon": 2}.get(geom["type"])
+    if depth is None:
+        return list(geometry.shape(geom).bounds)
+
+    # flatten rings and parts to a list of positions
+    positions = geom["coordinates"]
+    for _ in range(depth):
+        positions = [position for part in positions for position in part]
+    if not positions:
+        # empty geometry
+        return list(geometry.shape(geom).bounds)
+    xy = np.asarray([position[:2] for position in positions], dtype=float)
+    return [*xy.min(axis=0).tolist(), *xy.max(axis=0).tolist()]
+
+
+def _dumps_json(obj):
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
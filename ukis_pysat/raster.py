@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
 import math
+import os
+import warnings
+from functools import lru_cache
 from itertools import product
 from pathlib import Path
 
@@ -16,7 +19,7 @@ try:
     import rasterio.windows
     import shapely.geometry
     from rasterio.io import MemoryFile
-    from rio_toa import reflectance, brightness_temp, toa_utils
+    from rio_toa import toa_utils
 except ImportError as e:
     msg = (
         "ukis_pysat.raster dependencies are not installed.\n\n"
@@ -25,6 +28,39 @@ except ImportError as e:
     )
     raise ImportError(str(e) + "\n\n" + msg)
 
+try:
+    import numexpr
+except ImportError:
+    numexpr = None  # optional, dn2toa falls back to numba or plain numpy
+
+# GDAL configuration options used while Image reads or writes files
+_GDAL_OPTIONS = {
+    "GDAL_CACHEMAX": 512 * 1024**2,  # bytes
+    "GDAL_NUM_THREADS": "ALL_CPUS",
+    "VSI_CACHE": "TRUE",
+}
+
+
+def configure_gdal(**options):
+    """Sets GDAL configuration options that are used while Image reads or writes files. By default the block cache is
+    increased to 512 MB and all CPUs are used for (de)compression. Options already set by the caller, in an outer
+    rasterio.Env or as environment variables, take precedence.
+
+    :param options: GDAL configuration options, e.g. GDAL_CACHEMAX=1024**3, see https://gdal.org/user/configoptions.html
+    :return: dict with all GDAL configuration options used by Image
+    """
+    _GDAL_OPTIONS.update(options)
+    return dict(_GDAL_OPTIONS)
+
+
+def _gdal_env():
+    """rasterio.Env with the GDAL configuration options of configure_gdal that the caller has not set already.
+
+    :return: rasterio.Env
+    """
+    outer = rasterio.env.getenv() if rasterio.env.hasenv() else {}
+    return rasterio.Env(**{k: v for k, v in _GDAL_OPTIONS.items() if k not in outer and k not in os.environ})
+
 
 class Image:
 
@@ -46,11 +82,13 @@ class Image:
 
         if isinstance(data, rasterio.io.DatasetReader):
             self.dataset = data
-            self.__arr = self.dataset.read()
+            with _gdal_env():
+                self.__arr = self.dataset.read()
 
         elif isinstance(data, (str, Path)):
-            self.dataset = rasterio.open(data)
-            self.__arr = self.dataset.read()
+            with _gdal_env():
+                self.dataset = rasterio.open(data)
+                self.__arr = self.dataset.read()
 
         elif isinstance(data, np.ndarray):
             if crs is None:
@@ -186,14 +224,18 @@ class Image:
         self.__arr = destination
         self.__update_dataset(self.dataset.crs, transform, nodata=self.dataset.nodata)
 
-    def __update_dataset(self, crs, transform, nodata=None):
+    def __update_dataset(self, crs, transform, nodata=None, scales=None):
         """Update dataset without writing to file after it theoretically changed.
 
         :param crs: crs of the dataset
         :param transform: transform of the dataset
         :param nodata: nodata value, optional
+        :param scales: scale factor per band to get physical values from the stored ones, optional (default: None,
+            means scales of the current dataset are kept if the number of bands did not change)
         :return: file in memory, open as dataset
         """
+        if scales is None and self.dataset is not None and self.dataset.count == self.__arr.shape[0]:
+            scales = self.dataset.scales
 
         meta = {
             "driver": "GTiff",
@@ -209,6 +251,8 @@ class Image:
         memfile = MemoryFile()
         with memfile.open(**meta) as ds:
             ds.write(self.__arr)
+            if scales is not None:
+                ds.scales = scales
         self.dataset = memfile.open()
         memfile.close()
 
@@ -265,14 +309,22 @@ class Image:
 
         self.__update_dataset(dst_crs, transform, nodata=nodata)
 
-    def dn2toa(self, platform, mtl_file=None, wavelengths=None):
+    def dn2toa(self, platform, mtl_file=None, wavelengths=None, dtype_out="float32"):
         """This method converts digital numbers to top of atmosphere reflectance, like described here:
         https://www.usgs.gov/land-resources/nli/landsat/using-usgs-landsat-level-1-data-product
 
         :param platform: image platform, possible Platform.Landsat[5, 7, 8] or Platform.Sentinel2 (<enum 'Platform'>).
         :param mtl_file: path to Landsat MTL file that holds the band specific rescale factors (str).
         :param wavelengths: like ["Blue", "Green", "Red", "NIR", "SWIR1", "TIRS", "SWIR2"] for Landsat-5 (list of str).
+        :param dtype_out: 'float32' or 'uint16' (default: 'float32'). With 'uint16' reflectance is stored scaled by
+            10000 and brightness temperature in Kelvin scaled by 100, which halves the memory. The scale factors to get
+            the physical values back are set as scales of the dataset (0.0001 and 0.01) and nodata becomes 0. Note that
+            reflectance below 0.00005, e.g. of dark water, is stored as 0 as well and therefore reads as nodata.
         """
+        dtype_out = np.dtype(dtype_out).name
+        if dtype_out not in ("float32", "uint16"):
+            raise TypeError("dtype_out must be either 'float32' or 'uint16'.")
+
         if platform in [
             Platform.Landsat5,
             Platform.Landsat7,
@@ -285,55 +337,67 @@ class Image:
                 mtl = toa_utils._load_mtl(str(mtl_file))  # no obvious reason not to call this
                 metadata = mtl["L1_METADATA_FILE"]
                 sun_elevation = metadata["IMAGE_ATTRIBUTES"]["SUN_ELEVATION"]
-                toa = []
-
-                for idx, b in enumerate(self._lookup_bands(platform, wavelengths)):
+                if platform == Platform.Landsat8:
+                    thermal_constants_group = "TIRS_THERMAL_CONSTANTS"
+                else:
+                    thermal_constants_group = "THERMAL_CONSTANTS"
+
+                bands = self._lookup_bands(platform, wavelengths)
+                mult = np.zeros(len(bands), dtype=np.float32)
+                add = np.zeros(len(bands), dtype=np.float32)
+                k1 = np.zeros(len(bands), dtype=np.float32)
+                k2 = np.zeros(len(bands), dtype=np.float32)
+                is_thermal = np.zeros(len(bands), dtype=bool)
+
+                for idx, b in enumerate(bands):
                     if (platform == Platform.Landsat8 and b in ["10", "11"]) or (
                         platform != Platform.Landsat8 and b.startswith("6")
                     ):
-                        if platform == Platform.Landsat8:
-                            thermal_conversion_constant1 = metadata["TIRS_THERMAL_CONSTANTS"][f"K1_CONSTANT_BAND_{b}"]
-                            thermal_conversion_constant2 = metadata["TIRS_THERMAL_CONSTANTS"][f"K2_CONSTANT_BAND_{b}"]
-                        else:
-                            thermal_conversion_constant1 = metadata["THERMAL_CONSTANTS"][f"K1_CONSTANT_BAND_{b}"]
-                            thermal_conversion_constant2 = metadata["THERMAL_CONSTANTS"][f"K2_CONSTANT_BAND_{b}"]
-                        multiplicative_rescaling_factors = metadata["RADIOMETRIC_RESCALING"][f"RADIANCE_MULT_BAND_{b}"]
-                        additive_rescaling_factors = metadata["RADIOMETRIC_RESCALING"][f"RADIANCE_ADD_BAND_{b}"]
-
-                        # rescale thermal bands
-                        toa.append(
-                            brightness_temp.brightness_temp(
-                                self.__arr[idx, :, :],
-                                ML=multiplicative_rescaling_factors,
-                                AL=additive_rescaling_factors,
-                                K1=thermal_conversion_constant1,
-                                K2=thermal_conversion_constant2,
-                            )
-                        )
-                        continue
-
-                    # rescale reflectance bands
-                    multiplicative_rescaling_factors = metadata["RADIOMETRIC_RESCALING"][f"REFLECTANCE_MULT_BAND_{b}"]
-                    additive_rescaling_factors = metadata["RADIOMETRIC_RESCALING"][f"REFLECTANCE_ADD_BAND_{b}"]
-                    toa.append(
-                        reflectance.reflectance(
-                            self.__arr[idx, :, :],
-                            MR=multiplicative_rescaling_factors,
-                            AR=additive_rescaling_factors,
-                            E=sun_elevation,
-                        )
-                    )
-
-                self.__arr = np.array(np.stack(toa, axis=0))
+                        # thermal bands are rescaled to radiance and converted to brightness temperature
+                        is_thermal[idx] = True
+                        mult[idx] = metadata["RADIOMETRIC_RESCALING"][f"RADIANCE_MULT_BAND_{b}"]
+                        add[idx] = metadata["RADIOMETRIC_RESCALING"][f"RADIANCE_ADD_BAND_{b}"]
+                        k1[idx] = metadata[thermal_constants_group][f"K1_CONSTANT_BAND_{b}"]
+                        k2[idx] = metadata[thermal_constants_group][f"K2_CONSTANT_BAND_{b}"]
+                    else:
+                        mult[idx] = metadata["RADIOMETRIC_RESCALING"][f"REFLECTANCE_MULT_BAND_{b}"]
+                        add[idx] = metadata["RADIOMETRIC_RESCALING"][f"REFLECTANCE_ADD_BAND_{b}"]
+
+                if sun_elevation < 0 and not is_thermal.all():
+                    raise ValueError("Sun elevation must be nonnegative (sun must be above horizon for entire scene)")
+
+                # cos(solar zenith angle) equals sin(sun elevation), the sun angle correction of the reflective bands
+                # is folded into their rescaling factors to save a division per pixel
+                cos_sza = math.sin(math.radians(sun_elevation))
+                mult[~is_thermal] /= cos_sza
+                add[~is_thermal] /= cos_sza
+                self.__arr = _dn2toa(self.__arr, mult, add, k1, k2, is_thermal)
+
+                if dtype_out == "uint16":
+                    scales = tuple(np.where(is_thermal, 0.01, 0.0001).tolist())
+                    self.__arr = _quantize(self.__arr, scales)
         elif platform == Platform.Sentinel2:
-            self.__arr = self.__arr.astype(np.float32) / 10000.0
+            if dtype_out == "uint16":
+                # Sentinel-2 digital numbers already are reflectance scaled by 10000
+                self.__arr = self.__arr.astype(np.uint16, copy=False)
+                scales = (0.0001,) * self.__arr.shape[0]
+            else:
+                self.__arr = self.__arr.astype(np.float32) / 10000.0
         else:
             raise AttributeError(
                 f"Cannot convert dn2toa. Platform {platform} not supported [Landsat-5, Landsat-7, Landsat-8, "
                 f"Sentinel-2]. "
             )
 
-        self.__update_dataset(self.dataset.crs, self.dataset.transform, nodata=self.dataset.nodata)
+        if dtype_out == "uint16":
+            self.__update_dataset(self.dataset.crs, self.dataset.transform, nodata=0, scales=scales)
+        else:
+            self.__update_dataset(
+                self.dataset.crs,
+                self.dataset.transform,
+                nodata=self.dataset.nodata,
+                scales=(1.0,) * self.__arr.shape[0],
+            )
 
     @staticmethod
     def _lookup_bands(platform, wavelengths):
@@ -414,10 +478,12 @@ class Image:
         bounds = rasterio.windows.bounds(tile, self.dataset.transform)
         return self.__arr[(band,) + tile.toslices()], bounds  # Shape of array is announced with (bands, height, width)
 
-    def to_dask_array(self, chunk_size=(1, 6000, 6000)):
+    def to_dask_array(self, chunk_size=None, chunk_mb=128):
         """transforms numpy to dask array
 
-        :param chunk_size: tuple, size of chunk, optional (default: (1, 6000, 6000))
+        :param chunk_size: tuple, size of chunk, optional (default: None, chunks span all bands and are an integer
+            multiple of the internal block shape of the dataset with a size of about chunk_mb)
+        :param chunk_mb: int, target size of a chunk in MB if chunk_size is None, optional (default: 128)
         :return: dask array
         """
         try:
@@ -425,6 +491,28 @@ class Image:
         except ImportError:
             raise ImportError("to_dask_array requires optional dependency dask[array].")
 
+        block_y, block_x = self.dataset.block_shapes[0]
+        bands, rows, cols = self.__arr.shape
+
+        if chunk_size is None:
+            # grow chunks by whole blocks, as square as the array allows, until they reach the target size
+            n_blocks = max(1, (chunk_mb * 1024**2) // (bands * block_y * block_x * self.__arr.itemsize))
+            n_x = max(1, min(math.ceil(cols / block_x), int(math.sqrt(n_blocks))))
+            n_y = max(1, min(math.ceil(rows / block_y), n_blocks // n_x))
+            chunk_size = (bands, n_y * block_y, n_x * block_x)
+
+        elif isinstance(chunk_size, tuple) and len(chunk_size) == 3:
+            # None, -1, "auto" or explicit chunks per dimension are left to dask, only plain sizes are checked
+            misaligned = any(
+                isinstance(size, int) and 0 < size < extent and size % block
+                for size, block, extent in ((chunk_size[1], block_y, rows), (chunk_size[2], block_x, cols))
+            )
+            if misaligned:
+                warnings.warn(
+                    f"chunk_size {chunk_size} is not a multiple of the block shape {(block_y, block_x)} of the dataset, "
+                    f"chunks will not be aligned with blocks."
+                )
+
         self.da_arr = da.from_array(self.__arr, chunks=chunk_size)
         return self.da_arr
 
@@ -440,6 +528,45 @@ class Image:
         :param kwargs: driver specific keyword arguments, e.g. {'nbits': 1, 'tiled': True} for GTiff (default: None)
             for more keyword arguments see gdal driver specifications, e.g. https://gdal.org/drivers/raster/gtiff.html
         """
+        profile = self._get_profile(dtype, driver, nodata, compress, kwargs)
+
+        with _gdal_env(), rasterio.open(path_to_file, "w", **profile) as dst:
+            self._copy_scales(dst)
+            dst.write(self.__arr.astype(profile["dtype"]))
+
+    def write_to_memoryfile(self, dtype, driver="GTiff", nodata=None, compress=None, kwargs=None):
+        """
+        Write a dataset to an in-memory file, e.g. to pass it on to other processing steps without writing to disk.
+        :param dtype: datatype, like np.uint16, 'float32' or 'min' to use the minimum type to represent values
+
+        :param driver: str, optional (default: 'GTiff')
+        :param nodata: nodata value, e.g. 255 (default: None, means nodata value of dataset will be used)
+        :param compress: compression, e.g. 'lzw' (default: None)
+        :param kwargs: driver specific keyword arguments, e.g. {'nbits': 1, 'tiled': True} for GTiff (default: None)
+            for more keyword arguments see gdal driver specifications, e.g. https://gdal.org/drivers/raster/gtiff.html
+        :return: rasterio.io.MemoryFile, should be closed after use
+        """
+        profile = self._get_profile(dtype, driver, nodata, compress, kwargs)
+
+        memfile = MemoryFile()
+        with memfile.open(**profile) as dst:
+            self._copy_scales(dst)
+            dst.write(self.__arr.astype(profile["dtype"]))
+        return memfile
+
+    def _copy_scales(self, dst):
+        """Set the scales of the dataset on dst, e.g. the ones of a uint16 TOA image, so they are not lost on writing.
+
+        :param dst: dataset opened in write mode
+        """
+        if any(scale != 1.0 for scale in self.dataset.scales):
+            dst.scales = self.dataset.scales
+
+    def _get_profile(self, dtype, driver="GTiff", nodata=None, compress=None, kwargs=None):
+        """Profile for writing the dataset, see write_to_file for parameters.
+
+        :return: dict
+        """
         if type(dtype) is str and dtype == "min":
             dtype = rasterio.dtypes.get_minimum_dtype(self.__arr)
 
@@ -464,8 +591,7 @@ class Image:
         if kwargs:
             profile.update(**kwargs)
 
-        with rasterio.open(path_to_file, "w", **profile) as dst:
-            dst.write(self.__arr.astype(dtype))
+        return profile
 
     def close(self):
         """closes Image"""
@@ -473,3 +599,104 @@ class Image:
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
+
+
+def _dn2toa(dn, mult, add, k1, k2, is_thermal):
+    """Converts Landsat digital numbers to top of atmosphere reflectance and brightness temperature (in Kelvin).
+    Every band is converted in a single fused pass, using numexpr if available, else a parallel numba kernel, else
+    plain numpy. Pixels with DN 0 are treated as nodata (0 for reflectance, NaN for brightness temperature).
+
+    :param dn: np.ndarray of shape (bands, rows, columns) with digital numbers.
+    :param mult: np.ndarray with multiplicative rescaling factor per band, divided by cos(solar zenith angle) for
+        reflective bands.
+    :param add: np.ndarray with additive rescaling factor per band, divided by cos(solar zenith angle) for reflective
+        bands.
+    :param k1: np.ndarray with thermal conversion constant K1 per band, ignored for reflective bands.
+    :param k2: np.ndarray with thermal conversion constant K2 per band, ignored for reflective bands.
+    :param is_thermal: np.ndarray of bools, True for thermal bands.
+    :return: np.ndarray of type float32 with same shape as dn.
+    """
+    if numexpr is None:
+        dn2toa_numba = _get_dn2toa_numba()
+        if dn2toa_numba is not None:
+            return dn2toa_numba(dn, mult, add, k1, k2, is_thermal)
+
+    toa = dn.astype(np.float32)
+    nan = np.float32(np.nan)
+
+    for idx in range(toa.shape[0]):
+        band = toa[idx]
+        m, a = mult[idx], add[idx]
+        if numexpr is not None:
+            if is_thermal[idx]:
+                expr = "where(band == 0, nan, k2 / log(k1 / (m * band + a) + 1))"
+                local_dict = {"band": band, "m": m, "a": a, "k1": k1[idx], "k2": k2[idx], "nan": nan}
+            else:
+                expr = "where(band == 0, 0, m * band + a)"
+                local_dict = {"band": band, "m": m, "a": a}
+            numexpr.evaluate(expr, local_dict=local_dict, out=band, casting="same_kind")
+        else:
+            nodata = band == 0
+            band *= m
+            band += a
+            if is_thermal[idx]:
+                np.divide(k1[idx], band, out=band)
+                band += 1
+                np.log(band, out=band)
+                np.divide(k2[idx], band, out=band)
+                band[nodata] = nan
+            else:
+                band[nodata] = 0
+
+    return toa
+
+
+def _quantize(toa, scales):
+    """Quantizes top of atmosphere values to uint16 band by band, values are rounded to the given scales and clipped to
+    the uint16 range. NaN becomes 0.
+
+    :param toa: np.ndarray of type float32 with shape (bands, rows, columns), is modified in place.
+    :param scales: scale factor per band, e.g. 0.0001 to store reflectance multiplied by 10000 (tuple of floats).
+    :return: np.ndarray of type uint16 with same shape as toa.
+    """
+    quantized = np.empty(toa.shape, dtype=np.uint16)
+    for idx, scale in enumerate(scales):
+        band = toa[idx]
+        band *= np.float32(round(1 / scale))
+        np.rint(band, out=band)
+        np.clip(band, 0, np.iinfo(np.uint16).max, out=band)
+        band[np.isnan(band)] = 0
+        quantized[idx] = band
+    return quantized
+
+
+@lru_cache(maxsize=None)
+def _get_dn2toa_numba():
+    """Builds the numba kernel of _dn2toa on first use, numba is only imported if numexpr is not available.
+
+    :return: compiled kernel with the signature of _dn2toa, None if numba is not installed.
+    """
+    try:
+        import numba
+    except ImportError:
+        return None
+
+    # no "nnan" and "ninf" fastmath flags, NaN is a valid result for thermal nodata pixels
+    @numba.njit(parallel=True, fastmath={"contract", "afn", "arcp", "reassoc", "nsz"}, cache=True)
+    def _dn2toa_numba(dn, mult, add, k1, k2, is_thermal):
+        """Numba kernel of _dn2toa, parallelized over bands and rows."""
+        bands, rows, cols = dn.shape
+        toa = np.empty((bands, rows, cols), dtype=np.float32)
+        for i in numba.prange(bands * rows):
+            b = i // rows
+            r = i % rows
+            for c in range(cols):
+                if dn[b, r, c] == 0:
+                    toa[b, r, c] = np.nan if is_thermal[b] else 0.0
+                elif is_thermal[b]:
+                    toa[b, r, c] = k2[b] / math.log(k1[b] / (mult[b] * dn[b, r, c] + add[b]) + 1.0)
+                else:
+                    toa[b, r, c] = mult[b] * dn[b, r, c] + add[b]
+        return toa
+
+    return _dn2toa_numba